@@ -0,0 +1,180 @@
+"""
+Numba kernels of RouteOptimizer over its travel time matrix.
+
+They live in their own module, importable under one fixed name, so numba's
+on-disk cache stays valid however route-optmizer.py itself is loaded.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit when numba is not installed."""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# Action codes of rows in the (action, order index, time) events array
+ACTION_WAITING = 0
+ACTION_PICKUP = 1
+ACTION_DELIVERY = 2
+
+@njit(cache=True)
+def _schedule_nb(tt, ready, n):
+    """
+    Nearest neighbor schedule over a travel time matrix laid out as in RouteOptimizer._build_travel_time_matrix.
+    
+    Args:
+        tt: Travel time matrix in minutes
+        ready: Time at which each order is ready for pickup
+        n: Number of orders (at most 64, the width of the bitmasks)
+        
+    Returns:
+        Visited matrix nodes in order
+    """
+    nodes = np.empty(2 * n, dtype=np.int64)
+    picked = np.uint64(0)
+    delivered = np.uint64(0)
+    time = 0.0
+    loc_idx = 0
+    
+    for step in range(2 * n):
+        # Nearest stop without waiting, and nearest restaurant that needs waiting as the fallback
+        best_node = -1
+        best_arrival_time = np.inf
+        wait_node = -1
+        wait_arrival_time = np.inf
+        for i in range(n):
+            bit = np.uint64(1) << np.uint64(i)
+            if picked & bit == 0:
+                arrival_time = time + tt[loc_idx, 1 + i]
+                if arrival_time >= ready[i]:
+                    if arrival_time < best_arrival_time:
+                        best_node = 1 + i
+                        best_arrival_time = arrival_time
+                elif arrival_time < wait_arrival_time:
+                    wait_node = 1 + i
+                    wait_arrival_time = arrival_time
+            elif delivered & bit == 0:
+                arrival_time = time + tt[loc_idx, 1 + n + i]
+                if arrival_time < best_arrival_time:
+                    best_node = 1 + n + i
+                    best_arrival_time = arrival_time
+        if best_node == -1:
+            best_node = wait_node
+            best_arrival_time = wait_arrival_time
+        
+        loc_idx = best_node
+        time = best_arrival_time
+        if best_node <= n:
+            time = max(time, ready[best_node - 1])
+            picked |= np.uint64(1) << np.uint64(best_node - 1)
+        else:
+            delivered |= np.uint64(1) << np.uint64(best_node - 1 - n)
+        nodes[step] = best_node
+    
+    return nodes
+
+@njit(cache=True)
+def _simulate_nb(tt, ready, n, nodes):
+    """
+    Replay a route of matrix nodes from the driver's position at time 0.
+    
+    Returns:
+        Array of (action code, order index, time) rows; a waiting row ends at the
+        time of the pickup row that follows it
+    """
+    events = np.empty((3 * n, 3), dtype=np.float64)
+    count = 0
+    time = 0.0
+    loc_idx = 0
+    for k in range(nodes.size):
+        node = nodes[k]
+        time += tt[loc_idx, node]
+        if node <= n:
+            if ready[node - 1] > time:
+                events[count, 0] = ACTION_WAITING
+                events[count, 1] = node - 1
+                events[count, 2] = time
+                count += 1
+                time = ready[node - 1]
+            events[count, 0] = ACTION_PICKUP
+            events[count, 1] = node - 1
+        else:
+            events[count, 0] = ACTION_DELIVERY
+            events[count, 1] = node - 1 - n
+        events[count, 2] = time
+        count += 1
+        loc_idx = node
+    return events[:count]
+
+@njit(cache=True)
+def _two_opt_nb(tt, ready, n, nodes, max_passes):
+    """
+    Improve a route by reversing segments while that shortens its total time.
+    
+    Reversals that would put a delivery before its pickup are skipped. Each pass
+    applies the first improving reversal found.
+    
+    Returns:
+        The improved route as a new array
+    """
+    nodes = nodes.copy()
+    m = nodes.size
+    prefix_time = np.empty(m + 1, dtype=np.float64)
+    prefix_loc = np.empty(m + 1, dtype=np.int64)
+    in_segment = np.zeros(n, dtype=np.bool_)
+    
+    for _ in range(max_passes):
+        # Departure time and location before each position of the current route
+        prefix_time[0] = 0.0
+        prefix_loc[0] = 0
+        for k in range(m):
+            node = nodes[k]
+            time = prefix_time[k] + tt[prefix_loc[k], node]
+            if node <= n:
+                time = max(time, ready[node - 1])
+            prefix_time[k + 1] = time
+            prefix_loc[k + 1] = node
+        best_time = prefix_time[m]
+        
+        improved = False
+        for i in range(m - 1):
+            in_segment[:] = False
+            if nodes[i] <= n:
+                in_segment[nodes[i] - 1] = True
+            for j in range(i + 1, m):
+                node = nodes[j]
+                if node > n and in_segment[node - 1 - n]:
+                    # Reversing nodes[i..j] or any longer segment would deliver before pickup
+                    break
+                if node <= n:
+                    in_segment[node - 1] = True
+                
+                time = prefix_time[i]
+                loc_idx = prefix_loc[i]
+                for k in range(j, i - 1, -1):
+                    time += tt[loc_idx, nodes[k]]
+                    if nodes[k] <= n:
+                        time = max(time, ready[nodes[k] - 1])
+                    loc_idx = nodes[k]
+                for k in range(j + 1, m):
+                    time += tt[loc_idx, nodes[k]]
+                    if nodes[k] <= n:
+                        time = max(time, ready[nodes[k] - 1])
+                    loc_idx = nodes[k]
+                
+                if time < best_time - 1e-9:
+                    nodes[i:j + 1] = nodes[i:j + 1][::-1].copy()
+                    improved = True
+                    break
+            if improved:
+                break
+        if not improved:
+            break
+    
+    return nodes
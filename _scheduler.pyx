@@ -0,0 +1,70 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True, language_level=3
+"""Compiled nearest neighbor scheduler used by RouteOptimizer when it is built."""
+import numpy as np
+from libc.math cimport INFINITY
+from libc.stdint cimport int64_t, uint64_t
+
+
+cpdef schedule(double[:, ::1] tt, double[::1] ready, long n):
+    """
+    Nearest neighbor schedule over a travel time matrix, same as _schedule_nb.
+
+    Args:
+        tt: Travel time matrix in minutes (node 0 driver, 1..N restaurants, N+1..2N customers)
+        ready: Time at which each order is ready for pickup
+        n: Number of orders (at most 64)
+
+    Returns:
+        Visited matrix nodes in order
+    """
+    if n > 64:
+        raise ValueError("schedule supports at most 64 orders")
+
+    nodes_arr = np.empty(2 * n, dtype=np.int64)
+    cdef int64_t[::1] nodes = nodes_arr
+    cdef uint64_t picked = 0
+    cdef uint64_t delivered = 0
+    cdef uint64_t bit
+    cdef double time = 0.0
+    cdef double best_arrival_time, wait_arrival_time, arrival_time
+    cdef long loc_idx = 0
+    cdef long best_node, wait_node, step, i
+
+    with nogil:
+        for step in range(2 * n):
+            # Nearest stop without waiting, and nearest restaurant that needs waiting as the fallback
+            best_node = -1
+            best_arrival_time = INFINITY
+            wait_node = -1
+            wait_arrival_time = INFINITY
+            for i in range(n):
+                bit = (<uint64_t>1) << i
+                if picked & bit == 0:
+                    arrival_time = time + tt[loc_idx, 1 + i]
+                    if arrival_time >= ready[i]:
+                        if arrival_time < best_arrival_time:
+                            best_node = 1 + i
+                            best_arrival_time = arrival_time
+                    elif arrival_time < wait_arrival_time:
+                        wait_node = 1 + i
+                        wait_arrival_time = arrival_time
+                elif delivered & bit == 0:
+                    arrival_time = time + tt[loc_idx, 1 + n + i]
+                    if arrival_time < best_arrival_time:
+                        best_node = 1 + n + i
+                        best_arrival_time = arrival_time
+            if best_node == -1:
+                best_node = wait_node
+                best_arrival_time = wait_arrival_time
+
+            loc_idx = best_node
+            time = best_arrival_time
+            if best_node <= n:
+                if ready[best_node - 1] > time:
+                    time = ready[best_node - 1]
+                picked |= (<uint64_t>1) << (best_node - 1)
+            else:
+                delivered |= (<uint64_t>1) << (best_node - 1 - n)
+            nodes[step] = best_node
+
+    return nodes_arr
@@ -1,67 +1,212 @@
-from dataclasses import dataclass
-from typing import List, Tuple, Dict, Optional, Set
+from dataclasses import dataclass, field
+from typing import List, Tuple, Dict, Optional, Callable, NamedTuple
 import math
 from enum import Enum
 import heapq
 from collections import defaultdict
+from functools import lru_cache
+from types import SimpleNamespace
+import os
+import sys
+import numpy as np
 
-@dataclass
+# _kernels and the optional _scheduler sit next to this file, which is loaded by path
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+if _MODULE_DIR not in sys.path:
+    sys.path.insert(0, _MODULE_DIR)
+
+from _kernels import (
+    NUMBA_AVAILABLE, njit, ACTION_WAITING, ACTION_PICKUP, ACTION_DELIVERY,
+    _schedule_nb, _simulate_nb, _two_opt_nb
+)
+
+try:
+    # Optional compiled scheduler, built with: python3 setup.py build_ext --inplace
+    from _scheduler import schedule as _schedule_ext
+except ImportError:
+    _schedule_ext = None
+
+MAX_KERNEL_ORDERS = 64  # picked/delivered bitmasks in the kernel are uint64
+SPECIALIZE_MAX_ORDERS = 8  # batch sizes that get a generated scheduler with the candidate loop unrolled
+TWO_OPT_MAX_PASSES = 50  # improving moves applied to a route before giving up
+IMPROVE_MAX_ORDERS = 16  # largest batch improved; 2-opt is O(N^3) per pass, which plain Python can afford up to here
+
+@dataclass(slots=True, frozen=True)
 class Location:
     """Represents a geographical location with latitude and longitude."""
     name: str
     lat: float
     lon: float
+    lat_rad: float = field(init=False, repr=False, compare=False)
+    lon_rad: float = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Frozen, so the derived radian values are set through object.__setattr__
+        object.__setattr__(self, 'lat_rad', math.radians(self.lat))
+        object.__setattr__(self, 'lon_rad', math.radians(self.lon))
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Restaurant:
     """Represents a restaurant with its location and preparation time."""
     location: Location
     prep_time: float  # in minutes
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Order:
     """Represents a delivery order with restaurant and customer details."""
     id: str
     restaurant: Restaurant
     customer: Location
+    placed_at: float = 0  # in minutes, on the same clock as the route
+    
+    @property
+    def ready_time(self) -> float:
+        """Time at which the order is ready for pickup at its restaurant."""
+        return self.placed_at + self.restaurant.prep_time
+
+class Event(NamedTuple):
+    """Represents a timeline entry; for 'waiting' events time is when waiting starts."""
+    action: str  # 'waiting', 'pickup' or 'delivery'
+    location: str
+    order_id: str
+    time: float  # in minutes
+    end_time: Optional[float] = None  # end of waiting, None for other actions
     
 class DeliveryState:
     """Represents the current state of deliveries and time calculations."""
-    def __init__(self, current_location: Location, current_time: float):
+    __slots__ = ('location', 'loc_idx', 'time', 'picked_mask', 'delivered_mask', 'restaurant_arrival_times')
+    
+    def __init__(self, current_location: Location, current_time: float, current_idx: int = 0):
         self.location = current_location
+        self.loc_idx = current_idx  # row of the current location in the travel time matrix
         self.time = current_time
-        self.picked_up_orders: Set[str] = set()
-        self.delivered_orders: Set[str] = set()
+        self.picked_mask = 0  # bit i set once the order at index i is picked up
+        self.delivered_mask = 0  # bit i set once the order at index i is delivered
         self.restaurant_arrival_times: Dict[str, float] = {}
 
+def _mask_to_bool(mask: int, n: int) -> np.ndarray:
+    """Unpack the low n bits of an order bitmask into a boolean array."""
+    packed = np.frombuffer(mask.to_bytes((n + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(packed, count=n, bitorder='little').astype(bool)
+
 class RouteOptimizer:
-    """Optimizes delivery routes using nearest neighbor approach with preparation time considerations."""
+    """
+    Optimizes delivery routes with preparation time considerations.
+    
+    A nearest neighbor route and an MST-based tour are built, and the better one
+    is refined with 2-opt moves that keep every pickup before its delivery.
+    """
     
     EARTH_RADIUS = 6371  # Earth's radius in kilometers
     AVG_SPEED = 20  # Average speed in km/hr
+    USE_EQUIRECT = True  # Flat-earth approximation, accurate to <0.01% for intra-city distances
+    # Generated fixed-size schedulers are compiled per process, which costs more than they save
+    # unless one process optimizes many batches; off by default so _schedule_nb's disk cache is used
+    USE_SPECIALIZED_SCHEDULERS = False
+    
+    _scheduler_cache: Dict[int, Callable] = {}  # batch size -> compiled scheduler, shared by all instances
     
     def __init__(self, driver_location: Location):
         """Initialize the route optimizer."""
         self.driver_location = driver_location
+        # Set by _build_travel_time_matrix
+        self._matrix_orders: Optional[List[Order]] = None
+        self._nodes: List[Location] = []
+        self._node_index: Dict[Location, int] = {}
+        self._tt: Optional[np.ndarray] = None
+        self._soa: Optional[SimpleNamespace] = None
         
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _central_angle(point1: Tuple[float, float], point2: Tuple[float, float]) -> float:
+        """
+        Calculate the central angle in radians between two (lat, lon) points in degrees.
+        
+        Callers round coordinates to 6 decimals (about 0.1 m), so stops at the same place
+        share cache entries whatever their names. Only used when USE_EQUIRECT is off.
+        """
+        lat1, lon1 = map(math.radians, point1)
+        lat2, lon2 = map(math.radians, point2)
+        
+        a = math.sin((lat2 - lat1)/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1)/2)**2
+        return 2 * math.asin(math.sqrt(a))
+    
     def haversine_distance(self, loc1: Location, loc2: Location) -> float:
         """Calculate the great circle distance between two points on Earth."""
-        lat1, lon1 = math.radians(loc1.lat), math.radians(loc1.lon)
-        lat2, lon2 = math.radians(loc2.lat), math.radians(loc2.lon)
+        if self.USE_EQUIRECT:
+            cos_lat = math.cos((loc1.lat_rad + loc2.lat_rad) / 2)
+            dx = (loc2.lon_rad - loc1.lon_rad) * cos_lat
+            dy = loc2.lat_rad - loc1.lat_rad
+            return self.EARTH_RADIUS * math.hypot(dx, dy)
+        
+        return self.EARTH_RADIUS * self._central_angle((round(loc1.lat, 6), round(loc1.lon, 6)),
+                                                       (round(loc2.lat, 6), round(loc2.lon, 6)))
+    
+    def _haversine_vec(self, lat1: float, lon1: float, lat_arr: np.ndarray, lon_arr: np.ndarray) -> np.ndarray:
+        """Calculate great circle distances from one point to arrays of points (all in radians)."""
+        a = np.sin((lat_arr - lat1)/2)**2 + np.cos(lat1) * np.cos(lat_arr) * np.sin((lon_arr - lon1)/2)**2
+        return 2 * self.EARTH_RADIUS * np.arcsin(np.sqrt(a))
+    
+    def _orders_soa(self, orders: List[Order]) -> SimpleNamespace:
+        """
+        Flatten the orders into parallel arrays indexed by order position.
         
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
+        Coordinates are float32 radian offsets from the driver's location, which keeps
+        them precise to well under a metre at city scale. Times are in minutes.
+        """
+        lat0, lon0 = self.driver_location.lat_rad, self.driver_location.lon_rad
         
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
+        def offsets(values: List[float], origin: float) -> np.ndarray:
+            return (np.array(values, dtype=np.float64) - origin).astype(np.float32)
         
-        return self.EARTH_RADIUS * c
+        soa = SimpleNamespace(
+            rest_lat=offsets([o.restaurant.location.lat_rad for o in orders], lat0),
+            rest_lon=offsets([o.restaurant.location.lon_rad for o in orders], lon0),
+            cust_lat=offsets([o.customer.lat_rad for o in orders], lat0),
+            cust_lon=offsets([o.customer.lon_rad for o in orders], lon0),
+            prep_time=np.array([o.restaurant.prep_time for o in orders], dtype=np.float64),
+            placed_at=np.array([o.placed_at for o in orders], dtype=np.float64),
+            order_id=np.array([o.id for o in orders], dtype=object)
+        )
+        soa.ready_time = soa.placed_at + soa.prep_time
+        return soa
     
     def travel_time(self, loc1: Location, loc2: Location) -> float:
         """Calculate travel time between two locations in minutes."""
         distance = self.haversine_distance(loc1, loc2)
         return (distance / self.AVG_SPEED) * 60
     
+    def _build_travel_time_matrix(self, orders: List[Order]) -> None:
+        """
+        Precompute travel times in minutes between all stops of the orders.
+        
+        Node 0 is the driver, nodes 1..N the restaurants and N+1..2N the customers,
+        in the order of the given list.
+        """
+        self._matrix_orders = list(orders)
+        self._nodes = ([self.driver_location] + [o.restaurant.location for o in orders]
+                       + [o.customer for o in orders])
+        # First node of each location; nodes at the same location share their travel times
+        self._node_index = {}
+        for idx, loc in enumerate(self._nodes):
+            self._node_index.setdefault(loc, idx)
+        self._soa = self._orders_soa(orders)
+        origin = np.zeros(1, dtype=np.float32)
+        lat = np.concatenate((origin, self._soa.rest_lat, self._soa.cust_lat))
+        lon = np.concatenate((origin, self._soa.rest_lon, self._soa.cust_lon))
+        
+        if self.USE_EQUIRECT:
+            self._cos_lat0 = math.cos(self.driver_location.lat_rad + float(lat.mean()))
+            dx = (lon[None, :] - lon[:, None]) * np.float32(self._cos_lat0)
+            dy = lat[None, :] - lat[:, None]
+            dist = self.EARTH_RADIUS * np.hypot(dx, dy)
+        else:
+            lat = self.driver_location.lat_rad + lat.astype(np.float64)
+            lon = self.driver_location.lon_rad + lon.astype(np.float64)
+            dist = self._haversine_vec(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+        # Route times accumulate in float64
+        self._tt = ((dist / self.AVG_SPEED) * 60).astype(np.float64)
+    
     def find_nearest_valid_location(self, 
                                   state: DeliveryState, 
                                   orders: List[Order],
@@ -69,6 +214,10 @@ class RouteOptimizer:
         """
         Find the nearest valid next location considering preparation times.
         
+        Distances are read from the travel time matrix of the orders, which is built
+        first if needed. The current row is state.loc_idx when that node is at
+        state.location, and is otherwise looked up from state.location.
+        
         Args:
             state: Current delivery state
             orders: List of all orders
@@ -76,47 +225,61 @@ class RouteOptimizer:
             
         Returns:
             Tuple of (next location, order ID, arrival time)
+        
+        Raises:
+            ValueError: If state.location is not a stop of these orders or the driver's location
         """
-        best_location = None
-        best_order_id = None
-        best_arrival_time = float('inf')
+        n = len(orders)
+        if self._matrix_orders != orders:
+            self._build_travel_time_matrix(orders)
+        loc_idx = state.loc_idx
+        if not 0 <= loc_idx <= 2 * n or self._nodes[loc_idx] != state.location:
+            if state.location not in self._node_index:
+                raise ValueError(f"{state.location.name} is not a stop of the given orders")
+            loc_idx = self._node_index[state.location]
+        picked_up = _mask_to_bool(state.picked_mask, n)
+        delivered = _mask_to_bool(state.delivered_mask, n)
+        # One pass over the current row; restaurants and customers are views into it
+        row_arrival_times = state.time + self._tt[loc_idx]
+        to_restaurant = row_arrival_times[1:n + 1]
+        to_customer = row_arrival_times[n + 1:]
         
-        for order in orders:
-            # Check restaurant pickup
-            if (order.id not in state.picked_up_orders and 
-                (not waiting_required or 
-                 state.time + self.travel_time(state.location, order.restaurant.location) < order.restaurant.prep_time)):
-                
-                arrival_time = state.time + self.travel_time(state.location, order.restaurant.location)
-                if arrival_time < best_arrival_time:
-                    best_location = order.restaurant.location
-                    best_order_id = order.id
-                    best_arrival_time = arrival_time
-                    
-            # Check customer delivery
-            if (order.id in state.picked_up_orders and 
-                order.id not in state.delivered_orders):
-                
-                arrival_time = state.time + self.travel_time(state.location, order.customer)
-                if arrival_time < best_arrival_time:
-                    best_location = order.customer
-                    best_order_id = order.id
-                    best_arrival_time = arrival_time
-                    
-        return best_location, best_order_id, best_arrival_time
+        pickup_eligible = ~picked_up
+        if not waiting_required:
+            # Only restaurants whose order is ready by the time the driver arrives
+            pickup_eligible &= to_restaurant >= self._soa.ready_time
+        delivery_eligible = picked_up & ~delivered
+        
+        # Interleave as (restaurant, customer) per order so ties resolve in order sequence
+        arrival_times = np.column_stack((
+            np.where(pickup_eligible, to_restaurant, np.inf),
+            np.where(delivery_eligible, to_customer, np.inf)
+        )).ravel()
+        if arrival_times.size == 0:
+            return None, None, float('inf')
+        
+        best = int(np.argmin(arrival_times))
+        best_arrival_time = arrival_times[best]
+        if best_arrival_time == np.inf:
+            return None, None, float('inf')
+        
+        order = orders[best // 2]
+        best_location = order.customer if best % 2 else order.restaurant.location
+        return best_location, order.id, float(best_arrival_time)
     
-    def optimize_route(self, orders: List[Order]) -> Tuple[List[Location], float, List[dict]]:
+    def _schedule_python(self, orders: List[Order]) -> np.ndarray:
         """
-        Find optimal route using nearest neighbor approach with preparation time considerations.
+        Run the nearest neighbor schedule step by step with find_nearest_valid_location.
         
         Returns:
-            Tuple of (route locations, total time, detailed timeline)
+            Visited matrix nodes, same as _schedule_nb
         """
         state = DeliveryState(self.driver_location, 0)
-        route = []
-        timeline = []
+        all_delivered = (1 << len(orders)) - 1
+        order_idx_by_id = {order_id: i for i, order_id in enumerate(self._soa.order_id)}
+        nodes = []
         
-        while len(state.delivered_orders) < len(orders):
+        while state.delivered_mask != all_delivered:
             # Try to find nearest location without waiting
             next_loc, order_id, arrival_time = self.find_nearest_valid_location(state, orders)
             
@@ -130,41 +293,183 @@ class RouteOptimizer:
                 state.time = arrival_time
                 
                 # Handle restaurant arrival
-                matching_order = next(o for o in orders if o.id == order_id)
+                order_idx = order_idx_by_id[order_id]
+                matching_order = orders[order_idx]
                 if next_loc == matching_order.restaurant.location:
+                    state.loc_idx = 1 + order_idx
                     # Wait for preparation if needed
-                    prep_end_time = max(state.time, matching_order.restaurant.prep_time)
-                    if prep_end_time > state.time:
-                        timeline.append({
-                            'action': 'waiting',
-                            'location': next_loc.name,
-                            'order_id': order_id,
-                            'start_time': state.time,
-                            'end_time': prep_end_time
-                        })
-                        state.time = prep_end_time
-                    
-                    state.picked_up_orders.add(order_id)
-                    timeline.append({
-                        'action': 'pickup',
-                        'location': next_loc.name,
-                        'order_id': order_id,
-                        'time': state.time
-                    })
+                    state.time = max(state.time, self._soa.ready_time[order_idx])
+                    state.picked_mask |= 1 << order_idx
                 else:
                     # Handle customer delivery
-                    state.delivered_orders.add(order_id)
-                    timeline.append({
-                        'action': 'delivery',
-                        'location': next_loc.name,
-                        'order_id': order_id,
-                        'time': state.time
-                    })
+                    state.loc_idx = 1 + len(orders) + order_idx
+                    state.delivered_mask |= 1 << order_idx
                 
-                route.append(next_loc)
+                nodes.append(state.loc_idx)
                 state.location = next_loc
             
-        return route, state.time, timeline
+        return np.array(nodes, dtype=np.int64)
+    
+    def _build_timeline(self, orders: List[Order], events: np.ndarray) -> Tuple[List[Location], float, List[Event]]:
+        """Materialize the route and timeline from the events array of _simulate_nb."""
+        route = []
+        timeline = []
+        rows = events.tolist()
+        
+        for k, (action, order_idx, time) in enumerate(rows):
+            order = orders[int(order_idx)]
+            if action == ACTION_WAITING:
+                timeline.append(Event('waiting', order.restaurant.location.name, order.id, time, rows[k + 1][2]))
+            elif action == ACTION_PICKUP:
+                route.append(order.restaurant.location)
+                timeline.append(Event('pickup', order.restaurant.location.name, order.id, time))
+            else:
+                route.append(order.customer)
+                timeline.append(Event('delivery', order.customer.name, order.id, time))
+        
+        total_time = rows[-1][2] if rows else 0
+        return route, total_time, timeline
+    
+    def _mst_tour(self, n: int) -> np.ndarray:
+        """
+        Build a pickup-before-delivery tour from a preorder walk of the travel time MST.
+        
+        Customers reached before their restaurant are deferred until right after it.
+        """
+        m = 2 * n + 1
+        in_tree = np.zeros(m, dtype=bool)
+        in_tree[0] = True
+        best_cost = self._tt[0].copy()
+        parent = np.zeros(m, dtype=np.intp)
+        children: List[List[int]] = [[] for _ in range(m)]
+        
+        # Prim's algorithm on the complete graph rooted at the driver
+        for _ in range(m - 1):
+            node = int(np.argmin(np.where(in_tree, np.inf, best_cost)))
+            in_tree[node] = True
+            children[parent[node]].append(node)
+            closer = ~in_tree & (self._tt[node] < best_cost)
+            best_cost[closer] = self._tt[node, closer]
+            parent[closer] = node
+        
+        tour = []
+        picked_up = np.zeros(n, dtype=bool)
+        deferred = np.zeros(n, dtype=bool)
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            # Visit nearer children first
+            stack.extend(sorted(children[node], key=lambda child: self._tt[node, child], reverse=True))
+            if node == 0:
+                continue
+            if node <= n:
+                tour.append(node)
+                picked_up[node - 1] = True
+                if deferred[node - 1]:
+                    tour.append(node + n)
+            elif picked_up[node - 1 - n]:
+                tour.append(node)
+            else:
+                deferred[node - 1 - n] = True
+        
+        return np.array(tour, dtype=np.int64)
+    
+    def _get_scheduler(self, n: int) -> Callable:
+        """
+        Return the nearest neighbor scheduler for batches of n orders.
+        
+        With USE_SPECIALIZED_SCHEDULERS, small batches get a function generated for
+        exactly n orders, with the candidate loop unrolled; it takes the same
+        arguments as _schedule_nb and is kept in memory for the process.
+        """
+        if not self.USE_SPECIALIZED_SCHEDULERS or n > SPECIALIZE_MAX_ORDERS:
+            return _schedule_nb
+        if n not in self._scheduler_cache:
+            candidates = "".join(
+                _SCHEDULER_CANDIDATE_TEMPLATE.format(bit=1 << i, order=i, restaurant=1 + i, customer=1 + n + i)
+                for i in range(n)
+            )
+            source = _SCHEDULER_TEMPLATE.format(n=n, steps=2 * n, candidates=candidates)
+            namespace = {'np': np}
+            exec(source, namespace)
+            # Generated code has no source file, so it cannot use numba's on-disk cache
+            self._scheduler_cache[n] = njit(namespace[f'_schedule_n{n}'])
+        return self._scheduler_cache[n]
+    
+    def _improve_route(self, nodes: np.ndarray, ready: np.ndarray, n: int) -> np.ndarray:
+        """Pick the faster of the given route and the MST tour, then refine it with 2-opt."""
+        mst_nodes = self._mst_tour(n)
+        if _simulate_nb(self._tt, ready, n, mst_nodes)[-1, 2] < _simulate_nb(self._tt, ready, n, nodes)[-1, 2]:
+            nodes = mst_nodes
+        return _two_opt_nb(self._tt, ready, n, nodes, TWO_OPT_MAX_PASSES)
+    
+    def optimize_route(self, orders: List[Order]) -> Tuple[List[Location], float, List[Event]]:
+        """
+        Find optimal route with preparation time considerations.
+        
+        Returns:
+            Tuple of (route locations, total time, detailed timeline)
+        """
+        self._build_travel_time_matrix(orders)
+        n = len(orders)
+        ready = self._soa.ready_time
+        if _schedule_ext is not None and n <= MAX_KERNEL_ORDERS:
+            nodes = _schedule_ext(self._tt, ready, n)
+        elif NUMBA_AVAILABLE and n <= MAX_KERNEL_ORDERS:
+            nodes = self._get_scheduler(n)(self._tt, ready, n)
+        else:
+            nodes = self._schedule_python(orders)
+        
+        # Same cap with or without numba, so a batch gets the same route either way
+        if 0 < n <= IMPROVE_MAX_ORDERS:
+            nodes = self._improve_route(nodes, ready, n)
+        
+        return self._build_timeline(orders, _simulate_nb(self._tt, ready, n, nodes))
+
+# Source of _schedule_nb specialized for a fixed number of orders; see RouteOptimizer._get_scheduler
+_SCHEDULER_TEMPLATE = """
+def _schedule_n{n}(tt, ready, n):
+    nodes = np.empty({steps}, dtype=np.int64)
+    picked = 0
+    delivered = 0
+    time = 0.0
+    loc_idx = 0
+    for step in range({steps}):
+        best_node = -1
+        best_arrival_time = np.inf
+        wait_node = -1
+        wait_arrival_time = np.inf
+{candidates}
+        if best_node == -1:
+            best_node = wait_node
+            best_arrival_time = wait_arrival_time
+        loc_idx = best_node
+        time = best_arrival_time
+        if best_node <= {n}:
+            time = max(time, ready[best_node - 1])
+            picked |= 1 << (best_node - 1)
+        else:
+            delivered |= 1 << (best_node - {n} - 1)
+        nodes[step] = best_node
+    return nodes
+"""
+
+_SCHEDULER_CANDIDATE_TEMPLATE = """
+        if picked & {bit} == 0:
+            arrival_time = time + tt[loc_idx, {restaurant}]
+            if arrival_time >= ready[{order}]:
+                if arrival_time < best_arrival_time:
+                    best_node = {restaurant}
+                    best_arrival_time = arrival_time
+            elif arrival_time < wait_arrival_time:
+                wait_node = {restaurant}
+                wait_arrival_time = arrival_time
+        elif delivered & {bit} == 0:
+            arrival_time = time + tt[loc_idx, {customer}]
+            if arrival_time < best_arrival_time:
+                best_node = {customer}
+                best_arrival_time = arrival_time
+"""
 
 def main():
     """Example usage of the optimized RouteOptimizer."""
@@ -194,12 +499,12 @@ def main():
     
     print("Optimized Route Timeline:")
     for event in timeline:
-        if event['action'] == 'waiting':
-            print(f"Waiting at {event['location']} for order {event['order_id']}")
-            print(f"  From {event['start_time']:.1f} to {event['end_time']:.1f} minutes")
+        if event.action == 'waiting':
+            print(f"Waiting at {event.location} for order {event.order_id}")
+            print(f"  From {event.time:.1f} to {event.end_time:.1f} minutes")
         else:
-            print(f"{event['action'].title()} at {event['location']} for order {event['order_id']}")
-            print(f"  Time: {event['time']:.1f} minutes")
+            print(f"{event.action.title()} at {event.location} for order {event.order_id}")
+            print(f"  Time: {event.time:.1f} minutes")
     
     print(f"\nTotal delivery time: {total_time:.1f} minutes")
 
@@ -0,0 +1,8 @@
+from setuptools import Extension, setup
+from Cython.Build import cythonize
+
+# Builds the optional compiled scheduler: python3 setup.py build_ext --inplace
+setup(
+    name="route-optimizer",
+    ext_modules=cythonize([Extension("_scheduler", ["_scheduler.pyx"])]),
+)
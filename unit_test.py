@@ -5,7 +5,8 @@ import math
 from enum import Enum
 import heapq
 from collections import defaultdict
-from lucidity import Location,Restaurant,RouteOptimizer,Order
+import numpy as np
+from lucidity import Location,Restaurant,RouteOptimizer,Order,DeliveryState,_schedule_nb,_schedule_ext,_simulate_nb,_mask_to_bool
 
 # [Previous Location, Restaurant, Order, DeliveryState, and RouteOptimizer classes remain the same]
 # ... [Previous implementation code here] ...
@@ -51,6 +52,45 @@ class TestRouteOptimizer(unittest.TestCase):
         dist2 = self.optimizer.haversine_distance(self.c1_loc, self.r1_loc)
         self.assertAlmostEqual(dist1, dist2)
 
+    def test_haversine_distance_cached(self):
+        """Test that repeated distance lookups are served from the cache."""
+        self.optimizer.USE_EQUIRECT = False
+        self.optimizer.haversine_distance(self.r2_loc, self.c2_loc)
+        hits = RouteOptimizer._central_angle.cache_info().hits
+        self.optimizer.haversine_distance(self.r2_loc, self.c2_loc)
+        self.assertEqual(RouteOptimizer._central_angle.cache_info().hits, hits + 1)
+        
+        # Same coordinates under other names hit the same entry
+        self.optimizer.haversine_distance(Location("R2 copy", self.r2_loc.lat, self.r2_loc.lon),
+                                          Location("C2 copy", self.c2_loc.lat, self.c2_loc.lon))
+        self.assertEqual(RouteOptimizer._central_angle.cache_info().hits, hits + 2)
+
+    def test_vectorized_haversine_matches_scalar(self):
+        """Test that the batch distance computation agrees with haversine_distance."""
+        self.optimizer.USE_EQUIRECT = False
+        targets = [self.r1_loc, self.r2_loc, self.c1_loc, self.c2_loc]
+        distances = self.optimizer._haversine_vec(
+            math.radians(self.driver_loc.lat), math.radians(self.driver_loc.lon),
+            np.radians([loc.lat for loc in targets]), np.radians([loc.lon for loc in targets])
+        )
+        for loc, distance in zip(targets, distances):
+            self.assertAlmostEqual(distance, self.optimizer.haversine_distance(self.driver_loc, loc))
+
+    def test_travel_time_matrix(self):
+        """Test that the precomputed travel time matrix matches travel_time."""
+        orders = [
+            Order("1", self.r1, self.c1_loc),
+            Order("2", self.r2, self.c2_loc)
+        ]
+        self.optimizer._build_travel_time_matrix(orders)
+        nodes = [self.driver_loc, self.r1_loc, self.r2_loc, self.c1_loc, self.c2_loc]
+        
+        self.assertEqual(self.optimizer._tt.shape, (5, 5))
+        for i, loc1 in enumerate(nodes):
+            for j, loc2 in enumerate(nodes):
+                # The matrix uses one reference latitude for the whole batch
+                self.assertAlmostEqual(self.optimizer._tt[i, j], self.optimizer.travel_time(loc1, loc2), places=4)
+
     def test_travel_time(self):
         """Test travel time calculations."""
         # Test with known locations
@@ -61,6 +101,54 @@ class TestRouteOptimizer(unittest.TestCase):
         time = self.optimizer.travel_time(self.r1_loc, self.r1_loc)
         self.assertEqual(time, 0)
 
+    def test_mask_to_bool(self):
+        """Test unpacking of order bitmasks, including masks wider than 64 bits."""
+        self.assertEqual(_mask_to_bool(0b101, 4).tolist(), [True, False, True, False])
+        self.assertEqual(_mask_to_bool(0, 0).tolist(), [])
+        wide = _mask_to_bool(1 << 70, 71)
+        self.assertEqual(wide.sum(), 1)
+        self.assertTrue(wide[70])
+
+    def test_find_nearest_prefers_ready_orders(self):
+        """Test that stops needing a wait are only chosen when waiting is allowed."""
+        orders = [
+            Order("1", self.r1, self.c1_loc),
+            Order("2", Restaurant(self.r2_loc, prep_time=0), self.c2_loc)
+        ]
+        self.optimizer._build_travel_time_matrix(orders)
+        state = DeliveryState(self.driver_loc, 0)
+        
+        # Order 1 is still being prepared, so only order 2 qualifies without waiting
+        location, order_id, _ = self.optimizer.find_nearest_valid_location(state, orders)
+        self.assertEqual((location, order_id), (self.r2_loc, "2"))
+        
+        state.picked_mask = 0b10
+        state.delivered_mask = 0b10
+        location, order_id, _ = self.optimizer.find_nearest_valid_location(state, orders)
+        self.assertIsNone(location)
+        location, order_id, _ = self.optimizer.find_nearest_valid_location(state, orders, waiting_required=True)
+        self.assertEqual((location, order_id), (self.r1_loc, "1"))
+
+    def test_find_nearest_resolves_state_location(self):
+        """Test that the matrix is built on demand and the current row follows state.location."""
+        orders = [
+            Order("1", Restaurant(self.r2_loc, prep_time=0), self.c2_loc),
+            Order("2", Restaurant(self.c1_loc, prep_time=0), self.r1_loc)
+        ]
+        optimizer = RouteOptimizer(self.driver_loc)
+        location, order_id, _ = optimizer.find_nearest_valid_location(DeliveryState(self.driver_loc, 0), orders)
+        self.assertEqual((location, order_id), (self.r2_loc, "1"))
+
+        # A state built without a matrix index, as callers did before the matrix existed
+        state = DeliveryState(self.r2_loc, 10)
+        state.picked_mask = 0b1
+        location, order_id, arrival_time = optimizer.find_nearest_valid_location(state, orders)
+        self.assertEqual((location, order_id), (self.c2_loc, "1"))
+        self.assertAlmostEqual(arrival_time, 10 + optimizer._tt[1, 3])
+
+        with self.assertRaises(ValueError):
+            optimizer.find_nearest_valid_location(DeliveryState(Location("X", 12.0, 77.0), 0), orders)
+
     def test_single_order(self):
         """Test optimization with a single order."""
         orders = [Order("1", self.r1, self.c1_loc)]
@@ -74,8 +162,8 @@ class TestRouteOptimizer(unittest.TestCase):
         self.assertEqual(route[1], self.c1_loc)  # Then customer
         
         # Check timeline
-        self.assertTrue(any(event['action'] == 'pickup' for event in timeline))
-        self.assertTrue(any(event['action'] == 'delivery' for event in timeline))
+        self.assertTrue(any(event.action == 'pickup' for event in timeline))
+        self.assertTrue(any(event.action == 'delivery' for event in timeline))
 
     def test_multiple_orders(self):
         """Test optimization with multiple orders."""
@@ -89,11 +177,71 @@ class TestRouteOptimizer(unittest.TestCase):
         self.assertEqual(len(route), 4)  # Should visit 2 restaurants and 2 customers
         
         # Check timeline completeness
-        pickup_events = sum(1 for event in timeline if event['action'] == 'pickup')
-        delivery_events = sum(1 for event in timeline if event['action'] == 'delivery')
+        pickup_events = sum(1 for event in timeline if event.action == 'pickup')
+        delivery_events = sum(1 for event in timeline if event.action == 'delivery')
         self.assertEqual(pickup_events, 2)
         self.assertEqual(delivery_events, 2)
 
+    def test_scheduler_paths_agree(self):
+        """Test that the compiled scheduler matches the step-by-step schedule."""
+        orders = [
+            Order("1", self.r1, self.c1_loc),
+            Order("2", self.r2, self.c2_loc)
+        ]
+        self.optimizer._build_travel_time_matrix(orders)
+        ready = np.array([o.ready_time for o in orders], dtype=np.float64)
+        
+        np.testing.assert_array_equal(_schedule_nb(self.optimizer._tt, ready, len(orders)),
+                                      self.optimizer._schedule_python(orders))
+
+    def test_specialized_schedulers_agree(self):
+        """Test that generated fixed-size schedulers match the generic kernel."""
+        restaurants = [self.r1, self.r2, Restaurant(self.c2_loc, prep_time=5)]
+        customers = [self.c1_loc, self.c2_loc, self.r2_loc]
+        self.optimizer.USE_SPECIALIZED_SCHEDULERS = True
+        for n in range(1, len(restaurants) + 1):
+            orders = [Order(str(i), restaurants[i], customers[i]) for i in range(n)]
+            self.optimizer._build_travel_time_matrix(orders)
+            ready = self.optimizer._soa.ready_time
+            np.testing.assert_array_equal(self.optimizer._get_scheduler(n)(self.optimizer._tt, ready, n),
+                                          _schedule_nb(self.optimizer._tt, ready, n))
+
+    @unittest.skipIf(_schedule_ext is None, "compiled scheduler not built")
+    def test_compiled_scheduler_agrees(self):
+        """Test that the Cython scheduler matches the Numba kernel."""
+        orders = [
+            Order("1", self.r1, self.c1_loc),
+            Order("2", self.r2, self.c2_loc, placed_at=5)
+        ]
+        self.optimizer._build_travel_time_matrix(orders)
+        ready = self.optimizer._soa.ready_time
+        np.testing.assert_array_equal(_schedule_ext(self.optimizer._tt, ready, len(orders)),
+                                      _schedule_nb(self.optimizer._tt, ready, len(orders)))
+
+    def test_mst_tour_precedence(self):
+        """Test that the MST tour visits every stop once with pickups before deliveries."""
+        orders = [
+            Order("1", self.r1, self.c1_loc),
+            Order("2", self.r2, self.c2_loc)
+        ]
+        self.optimizer._build_travel_time_matrix(orders)
+        tour = self.optimizer._mst_tour(len(orders)).tolist()
+        
+        self.assertEqual(sorted(tour), [1, 2, 3, 4])
+        for order_idx in range(len(orders)):
+            self.assertLess(tour.index(1 + order_idx), tour.index(1 + len(orders) + order_idx))
+
+    def test_improved_route_not_slower_than_greedy(self):
+        """Test that route improvement never returns a slower route than nearest neighbor."""
+        orders = [
+            Order("1", self.r1, self.c1_loc),
+            Order("2", self.r2, self.c2_loc)
+        ]
+        route, total_time, timeline = self.optimizer.optimize_route(orders)
+        ready = np.array([o.ready_time for o in orders], dtype=np.float64)
+        greedy_events = _simulate_nb(self.optimizer._tt, ready, len(orders), self.optimizer._schedule_python(orders))
+        self.assertLessEqual(total_time, greedy_events[-1, 2])
+
     def test_preparation_time_handling(self):
         """Test handling of restaurant preparation times."""
         # Create order with long prep time
@@ -103,15 +251,24 @@ class TestRouteOptimizer(unittest.TestCase):
         route, total_time, timeline = self.optimizer.optimize_route(orders)
         
         # Check for waiting events in timeline
-        waiting_events = [event for event in timeline if event['action'] == 'waiting']
+        waiting_events = [event for event in timeline if event.action == 'waiting']
         self.assertTrue(len(waiting_events) > 0)
         
         # Verify waiting duration
         if waiting_events:
             wait_event = waiting_events[0]
-            wait_duration = wait_event['end_time'] - wait_event['start_time']
+            wait_duration = wait_event.end_time - wait_event.time
             self.assertGreater(wait_duration, 0)
 
+    def test_preparation_relative_to_placement(self):
+        """Test that preparation time counts from when the order was placed."""
+        orders = [Order("1", self.r1, self.c1_loc, placed_at=10)]
+        route, total_time, timeline = self.optimizer.optimize_route(orders)
+        
+        pickup_event = next(event for event in timeline if event.action == 'pickup')
+        self.assertEqual(pickup_event.time, 30)  # placed at 10 + 20 minutes preparation
+        self.assertGreater(total_time, 30)
+
     def test_optimization_constraints(self):
         """Test that optimization maintains required constraints."""
         orders = [
@@ -125,10 +282,10 @@ class TestRouteOptimizer(unittest.TestCase):
         delivery_times = {}
         
         for event in timeline:
-            if event['action'] == 'pickup':
-                pickup_times[event['order_id']] = event['time']
-            elif event['action'] == 'delivery':
-                delivery_times[event['order_id']] = event['time']
+            if event.action == 'pickup':
+                pickup_times[event.order_id] = event.time
+            elif event.action == 'delivery':
+                delivery_times[event.order_id] = event.time
         
         # Verify pickup before delivery for each order
         for order_id in pickup_times:
@@ -149,13 +306,13 @@ class TestRouteOptimizer(unittest.TestCase):
         # Check time increases monotonically
         last_time = 0
         for event in timeline:
-            if event['action'] == 'waiting':
-                self.assertGreaterEqual(event['start_time'], last_time)
-                self.assertGreater(event['end_time'], event['start_time'])
-                last_time = event['end_time']
+            if event.action == 'waiting':
+                self.assertGreaterEqual(event.time, last_time)
+                self.assertGreater(event.end_time, event.time)
+                last_time = event.end_time
             else:
-                self.assertGreaterEqual(event['time'], last_time)
-                last_time = event['time']
+                self.assertGreaterEqual(event.time, last_time)
+                last_time = event.time
 
 def run_tests():
     """Run all test cases."""